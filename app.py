@@ -4,17 +4,24 @@ IEEE PDF Agent - Web Interface
 A modern web interface for converting documents to IEEE format
 """
 
+# Patch the stdlib before anything else imports socket/threading so that
+# background conversions run as green threads on the eventlet hub.
+import eventlet
+eventlet.monkey_patch()
+
 import os
 import json
 import logging
 import uuid
+import hashlib
 from datetime import datetime
-from pathlib import Path
-from flask import Flask, render_template, request, jsonify, send_file
-from flask_socketio import SocketIO, emit
+from flask import Flask, Request, Response, render_template, request, jsonify, send_file
+from flask_socketio import SocketIO, emit, join_room
 from werkzeug.utils import secure_filename
 import threading
-import openai
+import time
+from collections import OrderedDict
+import orjson
 from dotenv import load_dotenv
 
 from pdf_agent import PDFAgent
@@ -22,30 +29,159 @@ from pdf_agent import PDFAgent
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Logging handlers and format are configured once, in pdf_agent
 logger = logging.getLogger(__name__)
 
+class StreamingUploadRequest(Request):
+    """Request that writes allowed uploads straight to the upload folder"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.streamed_uploads = []
+        self.kept_upload = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if filename and allowed_file(filename):
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            base, ext = os.path.splitext(secure_filename(filename))
+            name, n = f"{timestamp}_{base}{ext}", 1
+            # Exclusive create: parts of concurrent requests never share a file
+            while True:
+                try:
+                    stream = open(os.path.join(app.config['UPLOAD_FOLDER'], name), 'xb+')
+                    break
+                except FileExistsError:
+                    n += 1
+                    name = f"{timestamp}_{base}_{n}{ext}"
+            self.streamed_uploads.append(stream)
+            return stream
+        # Anything we would reject anyway goes to Werkzeug's default temp storage
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
 app = Flask(__name__)
+app.request_class = StreamingUploadRequest
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# Hand PDF downloads to the front-end server (nginx/Apache X-Sendfile) when deployed behind one
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+
+class OrjsonSerializer:
+    """json-module shim so python-socketio encodes packets with orjson"""
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        # socketio passes stdlib-only kwargs such as separators; orjson is compact already
+        return orjson.dumps(obj).decode('utf-8')
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return orjson.loads(s)
+
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet', json=OrjsonSerializer)
+
+class StatusEmitter:
+    """Coalesce conversion_status events per session into one batched emit"""
 
-socketio = SocketIO(app, cors_allowed_origins="*")
+    def __init__(self, sio, flush_interval=0.05, max_batch=140):
+        self.sio = sio
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def push(self, session_id, event):
+        """Queue an event; the first event of a burst schedules the flush"""
+        with self._lock:
+            buffer = self._buffers.get(session_id)
+            if buffer is None:
+                self._buffers[session_id] = [event]
+                full = None
+            else:
+                buffer.append(event)
+                # Don't let a busy session grow one huge frame; ship it now
+                full = self._buffers.pop(session_id) if len(buffer) >= self.max_batch else None
+        if full:
+            self.sio.emit('conversion_status_batch', full, to=session_id)
+        elif buffer is None:
+            self.sio.start_background_task(self._flush_later, session_id)
+
+    def _flush_later(self, session_id):
+        self.sio.sleep(self.flush_interval)
+        with self._lock:
+            events = self._buffers.pop(session_id, [])
+        if events:
+            self.sio.emit('conversion_status_batch', events, to=session_id)
 
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs('output', exist_ok=True)
 
+class SessionStore:
+    """Session mapping bounded by count (least recently used) and idle time"""
+
+    def __init__(self, maxsize=10000, ttl=24 * 60 * 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # session_id -> (last_access, session)
+
+    def __contains__(self, session_id):
+        return session_id in self._data
+
+    def __getitem__(self, session_id):
+        now = time.monotonic()
+        _, session = self._data[session_id]
+        self._data[session_id] = (now, session)
+        self._data.move_to_end(session_id)
+        return session
+
+    def __setitem__(self, session_id, session):
+        self._data[session_id] = (time.monotonic(), session)
+        self._data.move_to_end(session_id)
+        self.evict()
+
+    def evict(self):
+        """Drop expired sessions, then the least recently used over maxsize"""
+        cutoff = time.monotonic() - self.ttl
+        while self._data:
+            session_id, (last_access, _) = next(iter(self._data.items()))
+            if last_access >= cutoff and len(self._data) <= self.maxsize:
+                break
+            _, session = self._data.pop(session_id)
+            self._remove_uploads(session)
+
+    @staticmethod
+    def _remove_uploads(session):
+        # Upload names are timestamped per request, so only this session refers to them
+        for file_info in session['files']:
+            # A running conversion still reads its upload; leave that one be
+            if file_info.get('status') == 'processing':
+                continue
+            try:
+                os.remove(file_info['filepath'])
+            except OSError:
+                pass
+
 # Global variables for session management
-sessions = {}
-agent = PDFAgent()
+sessions = SessionStore()
+# Guards the session store and mutation of per-session file lists
+sessions_lock = threading.Lock()
+# pandoc/xelatex already run out of process, so conversions don't need a
+# process pool; just cap how many compile at once to the number of cores.
+# The agent holds a slot only around pandoc, not during AI refinement.
+conversion_slots = threading.BoundedSemaphore(os.cpu_count() or 1)
+agent = PDFAgent(pandoc_slots=conversion_slots)
 
-# Initialize OpenAI from agent config
-if agent.config.get('openai', {}).get('api_key'):
-    openai.api_key = agent.config['openai']['api_key']
-else:
-    openai.api_key = os.getenv('OPENAI_API_KEY')
+socketio_config = agent.config.get('socketio', {})
+status_emitter = StatusEmitter(
+    socketio,
+    flush_interval=socketio_config.get('flush_ms', 50) / 1000,
+    max_batch=socketio_config.get('max_batch', 140)
+)
+
+# Fall back to OPENAI_API_KEY when the config has no key; the agent reads it from its config
+if not agent.config['openai'].get('api_key'):
+    agent.config['openai']['api_key'] = os.getenv('OPENAI_API_KEY', '')
 
 # Update notifications system
 UPDATE_NOTIFICATIONS = [
@@ -67,28 +203,57 @@ UPDATE_NOTIFICATIONS = [
     }
 ]
 
-# Allowed file extensions
-ALLOWED_EXTENSIONS = {'.md', '.markdown', '.tex', '.latex'}
+# The notifications never change at runtime, so encode them (and their ETag) once
+_UPDATES_JSON = orjson.dumps(UPDATE_NOTIFICATIONS)
+_UPDATES_ETAG = hashlib.blake2b(_UPDATES_JSON, digest_size=16).hexdigest()
+
+# Allowed file extensions (a tuple so str.endswith can test them in one call)
+ALLOWED_EXTENSIONS = ('.md', '.markdown', '.tex', '.latex')
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
-    return Path(filename).suffix.lower() in ALLOWED_EXTENSIONS
+    return filename.lower().endswith(ALLOWED_EXTENSIONS)
 
 def get_session_id():
     """Generate a unique session ID"""
     return str(uuid.uuid4())
 
+def new_session(session_id):
+    """Build an empty session record"""
+    return {
+        'id': session_id,
+        'created_at': datetime.now(),
+        'files': [],
+        'files_by_name': {},
+        'status': 'active',
+        'dismissed_updates': []
+    }
+
 def get_session(session_id):
     """Get or create a session"""
-    if session_id not in sessions:
-        sessions[session_id] = {
-            'id': session_id,
-            'created_at': datetime.now(),
-            'files': [],
-            'status': 'active',
-            'dismissed_updates': []
-        }
-    return sessions[session_id]
+    with sessions_lock:
+        sessions.evict()
+        if session_id not in sessions:
+            sessions[session_id] = new_session(session_id)
+        return sessions[session_id]
+
+def find_session(session_id):
+    """Get an existing session without creating one, or None"""
+    with sessions_lock:
+        sessions.evict()
+        return sessions[session_id] if session_id in sessions else None
+
+@app.teardown_request
+def discard_streamed_uploads(exc=None):
+    """Delete uploads this request streamed to disk but did not keep"""
+    for stream in getattr(request, 'streamed_uploads', ()):
+        stream.close()
+        if stream.name == request.kept_upload:
+            continue
+        try:
+            os.remove(stream.name)
+        except OSError:
+            pass
 
 @app.route('/')
 def index():
@@ -109,21 +274,24 @@ def upload_file():
             return jsonify({'error': 'No file selected'}), 400
         
         if file and file.filename and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{timestamp}_{filename}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            # StreamingUploadRequest already wrote the bytes to their final path
+            file.stream.close()
+            filepath = file.stream.name
+            filename = os.path.basename(filepath)
             
             # Add to session
             session = get_session(session_id)
-            session['files'].append({
+            file_info = {
                 'filename': filename,
                 'original_name': file.filename,
                 'filepath': filepath,
                 'uploaded_at': datetime.now().isoformat(),
                 'status': 'uploaded'
-            })
+            }
+            with sessions_lock:
+                session['files'].append(file_info)
+                session['files_by_name'][filename] = file_info
+            request.kept_upload = filepath
             
             return jsonify({
                 'success': True,
@@ -135,7 +303,7 @@ def upload_file():
             return jsonify({'error': 'Invalid file type. Only .md, .markdown, .tex, .latex files are allowed'}), 400
     
     except Exception as e:
-        logger.error(f"Upload error: {e}")
+        logger.exception("Upload error: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/convert', methods=['POST'])
@@ -150,14 +318,8 @@ def convert_file():
         if not session_id or not filename:
             return jsonify({'error': 'Session ID and filename required'}), 400
         
-        session = get_session(session_id)
-        file_info = None
-        
-        # Find the file in session
-        for file in session['files']:
-            if file['filename'] == filename:
-                file_info = file
-                break
+        session = find_session(session_id)
+        file_info = session['files_by_name'].get(filename) if session else None
         
         if not file_info:
             return jsonify({'error': 'File not found in session'}), 404
@@ -166,12 +328,7 @@ def convert_file():
         file_info['status'] = 'processing'
         
         # Start conversion in background
-        thread = threading.Thread(
-            target=process_conversion,
-            args=(session_id, file_info, options)
-        )
-        thread.daemon = True
-        thread.start()
+        socketio.start_background_task(process_conversion, session_id, file_info, options)
         
         return jsonify({
             'success': True,
@@ -180,14 +337,35 @@ def convert_file():
         })
     
     except Exception as e:
-        logger.error(f"Conversion error: {e}")
+        logger.exception("Conversion error: %s", e)
         return jsonify({'error': str(e)}), 500
 
+def refinement_progress(session_id, file_info, interval=0.5):
+    """Build an on_delta callback that reports streamed AI output as status events"""
+    received = 0
+    last_push = 0.0
+
+    def on_delta(delta):
+        nonlocal received, last_push
+        received += len(delta)
+        now = time.monotonic()
+        if now - last_push >= interval:
+            last_push = now
+            status_emitter.push(session_id, {
+                'session_id': session_id,
+                'filename': file_info['filename'],
+                'status': 'refining',
+                'message': f'AI formatting in progress ({received} characters received)...',
+                'received': received
+            })
+
+    return on_delta
+
 def process_conversion(session_id, file_info, options):
     """Process file conversion in background"""
     try:
         # Emit status update
-        socketio.emit('conversion_status', {
+        status_emitter.push(session_id, {
             'session_id': session_id,
             'filename': file_info['filename'],
             'status': 'processing',
@@ -199,36 +377,32 @@ def process_conversion(session_id, file_info, options):
         email_recipient = options.get('email_recipient', None)
         use_ai_formatting = options.get('use_ai_formatting', False)
         
-        # Use the new process_file_with_fallback method
-        success = agent.process_file_with_fallback(
+        # process_file_with_fallback returns the path of the PDF it produced
+        pdf_path = agent.process_file_with_fallback(
             file_info['filepath'],
             send_email=send_email,
             email_recipient=email_recipient,
-            use_ai_refinement=use_ai_formatting
+            use_ai_refinement=use_ai_formatting,
+            on_delta=refinement_progress(session_id, file_info) if use_ai_formatting else None
         )
         
-        if success:
-            # Find the generated PDF
-            output_dir = agent.config['output']['directory']
-            pdf_files = list(Path(output_dir).glob('*.pdf'))
-            latest_pdf = max(pdf_files, key=os.path.getctime) if pdf_files else None
-            
+        if pdf_path:
             file_info['status'] = 'completed'
-            file_info['pdf_path'] = str(latest_pdf) if latest_pdf else None
+            file_info['pdf_path'] = pdf_path
             file_info['completed_at'] = datetime.now().isoformat()
             
-            socketio.emit('conversion_status', {
+            status_emitter.push(session_id, {
                 'session_id': session_id,
                 'filename': file_info['filename'],
                 'status': 'completed',
                 'message': 'Conversion completed successfully!',
-                'pdf_path': str(latest_pdf) if latest_pdf else None
+                'pdf_path': pdf_path
             })
         else:
             file_info['status'] = 'failed'
             file_info['error'] = 'Conversion failed'
             
-            socketio.emit('conversion_status', {
+            status_emitter.push(session_id, {
                 'session_id': session_id,
                 'filename': file_info['filename'],
                 'status': 'failed',
@@ -236,11 +410,11 @@ def process_conversion(session_id, file_info, options):
             })
     
     except Exception as e:
-        logger.error(f"Background conversion error: {e}")
+        logger.exception("Background conversion error: %s", e)
         file_info['status'] = 'failed'
         file_info['error'] = str(e)
         
-        socketio.emit('conversion_status', {
+        status_emitter.push(session_id, {
             'session_id': session_id,
             'filename': file_info['filename'],
             'status': 'failed',
@@ -253,23 +427,32 @@ def download_file(filename):
     try:
         file_path = os.path.join('output', filename)
         if os.path.exists(file_path):
-            return send_file(file_path, as_attachment=True)
+            # conditional enables ETag/Range handling; the body is served via
+            # wrap_file so the WSGI server can use sendfile()
+            return send_file(file_path, as_attachment=True, conditional=True)
         else:
             return jsonify({'error': 'File not found'}), 404
     except Exception as e:
-        logger.error(f"Download error: {e}")
+        logger.exception("Download error: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/session/<session_id>')
 def get_session_info(session_id):
     """Get session information"""
-    session = get_session(session_id)
-    return jsonify(session)
+    # Read-only: an unknown id gets an empty view, not a stored session,
+    # so these GETs can't push real sessions out of the store
+    session = find_session(session_id) or new_session(session_id)
+    # files_by_name is a lookup index over 'files'; don't ship it twice
+    return jsonify({k: v for k, v in session.items() if k != 'files_by_name'})
 
 @app.route('/api/updates')
 def get_updates():
     """Get available updates"""
-    return jsonify(UPDATE_NOTIFICATIONS)
+    response = Response(_UPDATES_JSON, mimetype='application/json')
+    response.set_etag(_UPDATES_ETAG)
+    response.cache_control.public = True
+    response.cache_control.max_age = 300
+    return response.make_conditional(request)
 
 @app.route('/api/updates/dismiss', methods=['POST'])
 def dismiss_update():
@@ -283,13 +466,14 @@ def dismiss_update():
             return jsonify({'error': 'Session ID and update ID required'}), 400
         
         session = get_session(session_id)
-        if update_id not in session['dismissed_updates']:
-            session['dismissed_updates'].append(update_id)
+        with sessions_lock:
+            if update_id not in session['dismissed_updates']:
+                session['dismissed_updates'].append(update_id)
         
         return jsonify({'success': True})
     
     except Exception as e:
-        logger.error(f"Update dismiss error: {e}")
+        logger.exception("Update dismiss error: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @socketio.on('connect')
@@ -298,6 +482,13 @@ def handle_connect():
     logger.info('Client connected')
     emit('connected', {'message': 'Connected to PDF Agent'})
 
+@socketio.on('join_session')
+def handle_join_session(data):
+    """Subscribe the client to status updates for its session"""
+    session_id = (data or {}).get('session_id')
+    if session_id:
+        join_room(session_id)
+
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle client disconnection"""
@@ -6,39 +6,360 @@ Supports academic formatting and email delivery
 
 import os
 import sys
+import copy
 import json
 import logging
-import smtplib
+import atexit
+import queue
 import subprocess
+import threading
 import argparse
+import weakref
+import asyncio
+import hashlib
+import importlib.util
+import re
+import shutil
+import tempfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 from datetime import datetime
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
-import openai
+
+# openai/httpx, tiktoken, smtplib and the email package are imported where
+# they are used, so a plain conversion run doesn't pay their import time
+
+try:
+    import orjson
+except ImportError:  # config files fall back to the stdlib json module
+    orjson = None
 
 # ----------------------------------------------------------------
 # Logging Setup
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("pdf_agent.log"),
-        logging.StreamHandler()
-    ]
-)
+# Callers only enqueue records; a listener thread does the file/console writes
+_log_queue = queue.Queue(-1)
+_log_formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+_log_handlers = [logging.FileHandler("pdf_agent.log"), logging.StreamHandler()]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+_queue_handler = QueueHandler(_log_queue)
+# The listener's handlers apply the real format; only render the message here
+_queue_handler.setFormatter(logging.Formatter("%(message)s"))
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
+_log_listener = QueueListener(_log_queue, *_log_handlers, respect_handler_level=True)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 
+# Bump whenever the refinement prompt changes so cached results are not reused
+IEEE_PROMPT_VERSION = 3
+REFINE_CACHE_SIZE = 512
+# Bound on refinement files kept on disk; least recently used go first
+REFINE_DISK_CACHE_SIZE = 4096
+# Bound on converted PDFs kept in the conversion cache, evicted the same way
+CONVERSION_CACHE_SIZE = 256
+
+# Fixed refinement instructions, sent as the system message. Keeping them
+# byte-identical across calls lets the provider reuse its cached prefix;
+# only the document itself varies in the user message.
+IEEE_SYSTEM_PROMPT = """\
+You are an expert IEEE research paper writer and editor. Convert the text supplied by the user into a formally structured IEEE-style research paper with the exact section layout and formatting rules described below.
+
+Required Paper Structure:
+
+Abstract:
+
+Write a single, cohesive paragraph summarizing the entire paper.
+
+Do not include the word "Abstract" at the beginning.
+
+Keywords:
+
+Provide 3–8 technical keywords separated by commas.
+
+Do not include the word "Keywords" at the beginning.
+
+I. INTRODUCTION
+
+Write a detailed paragraph introducing the topic, background, motivation, and objectives.
+
+Ensure clarity and academic tone.
+
+II. METHODOLOGY
+
+Write a detailed paragraph explaining the methods, techniques, datasets, or approaches used in the research.
+
+III. RESULTS AND DISCUSSION
+
+Present key findings, insights, or performance results.
+
+Include analytical discussion of implications, strengths, and limitations.
+
+IV. CONCLUSION
+
+Summarize the major contributions and findings.
+
+Include remarks on possible future work or open challenges.
+
+Formatting Rules:
+
+Do NOT include section headers like "Abstract:" or "Keywords:" in the text — only the content.
+
+Do NOT include section numbers (I., II., etc.) inside the content paragraphs.
+
+Each section must be written as a formal, detailed academic paragraph (not bullet points).
+
+Use technical, IEEE-style English — precise, impersonal, and objective.
+
+Preserve the technical meaning and flow of the original text but improve clarity and grammar.
+
+IMPORTANT: Your response should ONLY contain the properly formatted IEEE paper content. Do not include any explanations or additional text.
+"""
+
+# The bundled template lives next to this module, not necessarily in the cwd
+_MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_TEMPLATE = "ieee_template_proper.tex"
+
+# Lines of pandoc stderr kept for error reports; the rest only goes to debug
+PANDOC_STDERR_TAIL = 40
+
+# Per-call prompts; only file_type and content are filled in at call time
+IEEE_USER_PROMPT_TEMPLATE = """\
+Convert the following {file_type} text.
+
+Content:
+{content}
+"""
+
+CONDENSE_PROMPT_TEMPLATE = """\
+You are preparing a long {file_type} research document for IEEE-style rewriting. Condense the following portion of it.
+
+Keep every technical claim, method, dataset, equation, numeric result and citation. Remove repetition and filler. Keep the original section headings.
+
+Content:
+{content}
+
+IMPORTANT: Your response should ONLY contain the condensed {file_type} text.
+"""
+
+# Documents above this many tokens are condensed section by section before
+# the single IEEE refinement pass, so the prompt stays within max_tokens
+CHUNK_TOKEN_THRESHOLD = 3000
+
+# Input extensions, matched case-insensitively; LaTeX ones go to pandoc as latex
+_LATEX_EXT = frozenset({'.tex', '.latex'})
+_MARKDOWN_EXT = frozenset({'.md', '.markdown'})
+
+def file_type_for(path: str) -> str:
+    """Return 'latex' or 'markdown' for an input path, by extension"""
+    return 'latex' if os.path.splitext(path)[1].lower() in _LATEX_EXT else 'markdown'
+
+# Files a document pulls in: (pattern, suffixes tried when the name has none,
+# whether the match lists several names). They change the PDF without
+# changing the source, so the conversion cache fingerprints them too.
+_GRAPHICS_EXT = ('.pdf', '.png', '.jpg', '.jpeg', '.eps')
+_RESOURCE_REFS = (
+    (re.compile(rb'!\[[^\]]*\]\(\s*<?([^)\s>]+)'), _GRAPHICS_EXT, False),
+    (re.compile(rb'\\includegraphics\s*(?:\[[^\]]*\])?\s*\{([^}]+)\}'), _GRAPHICS_EXT, False),
+    (re.compile(rb'\\(?:input|include|subfile)\s*\{([^}]+)\}'), ('.tex',), False),
+    (re.compile(rb'\\(?:bibliography|addbibresource)\s*(?:\[[^\]]*\])?\s*\{([^}]+)\}'), ('.bib',), True),
+    (re.compile(rb'(?m)^(?:bibliography|csl):[ \t]*(.*(?:\n[ \t]+-.*)*)'), (), True),
+)
+_REF_LIST_SPLIT = re.compile(rb'[,\n]')
+
+_SECTION_SPLIT = {
+    'latex': re.compile(r'(?m)^(?=\\section\*?\{)'),
+    'markdown': re.compile(r'(?m)^(?=#{1,2} )'),
+}
+
+# Start of the bibliography; it and anything after it (appendices) is the
+# first thing dropped when a document still overflows the context window
+_REFERENCES_START = {
+    'latex': re.compile(r'(?mi)^\\(?:section\*?\{(?:references|bibliography)\}|begin\{thebibliography\})'),
+    'markdown': re.compile(r'(?mi)^#{1,6} +(?:references|bibliography)\s*$'),
+}
+
+# Tokens held back from the context window for the system prompt and framing
+CONTEXT_RESERVE_TOKENS = 512
+
+# Shared OpenAI client so every PDFAgent reuses one connection pool
+_openai_client = None
+_openai_client_key = None
+# Condense calls run on worker threads; only one of them may build the client
+_openai_client_lock = threading.Lock()
+
+# HTTP/2 multiplexes concurrent requests over one connection but needs h2
+_HTTP2 = importlib.util.find_spec("h2") is not None
+OPENAI_TIMEOUT = 60.0
+SMTP_TIMEOUT = 30.0
+
+def get_openai_client(api_key: str, max_retries: int = 5, timeout: float = OPENAI_TIMEOUT):
+    """Return the shared OpenAI client (the SDK retries 429/5xx itself), rebuilt only when its settings change"""
+    import httpx
+    import openai
+
+    global _openai_client, _openai_client_key
+    settings = (api_key, max_retries, timeout)
+    with _openai_client_lock:
+        if _openai_client is None or _openai_client_key != settings:
+            if _openai_client is not None:
+                _openai_client.close()
+            http_client = httpx.Client(
+                http2=_HTTP2,
+                timeout=timeout,
+                limits=httpx.Limits(max_keepalive_connections=4),
+            )
+            _openai_client = openai.OpenAI(api_key=api_key, http_client=http_client,
+                                           max_retries=max_retries)
+            _openai_client_key = settings
+        return _openai_client
+
+def _json_loads(data: bytes):
+    """Parse JSON bytes with orjson when installed, else the stdlib"""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def _json_dumps(obj) -> bytes:
+    """Serialize to indented JSON bytes with orjson when installed, else the stdlib"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode('utf-8')
+
+def _write_atomically(path: Path, write):
+    """Call write(tmp_path) on a unique temp file beside path, then rename it over path"""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f"{path.name}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+@lru_cache(maxsize=8)
+def _read_config(config_file: str, mtime: float):
+    """Parse a config file; cached per (path, mtime) so edits are picked up"""
+    with open(config_file, 'rb') as f:
+        return _json_loads(f.read())
+
+@lru_cache(maxsize=8)
+def _template_usable(template_path: str, mtime: float) -> bool:
+    """Whether pandoc accepts a template; checked once per (path, mtime)"""
+    try:
+        result = subprocess.run(
+            ["pandoc", "--template", template_path, "-f", "markdown", "-t", "latex"],
+            input="", capture_output=True, text=True, timeout=5
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning("Could not validate template %s: %s", template_path, e)
+        return False
+    if result.returncode != 0:
+        logger.warning("Template %s rejected by pandoc, converting without it: %s",
+                       template_path, result.stderr.strip())
+        return False
+    return True
+
+@lru_cache(maxsize=8)
+def _file_digest(path: str, mtime: float) -> bytes:
+    """Content digest of a file, keyed by mtime like _read_config"""
+    with open(path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=20).digest()
+
+@lru_cache(maxsize=8)
+def _get_encoding(model: str):
+    """Return the tiktoken encoding for a model, or None if unavailable"""
+    try:
+        import tiktoken
+    except ImportError:  # token counts fall back to a character estimate
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        try:
+            return tiktoken.get_encoding("o200k_base")
+        except Exception:
+            return None
+
+def count_tokens(text: str, model: str) -> int:
+    """Count tokens with tiktoken when available, else estimate ~4 chars per token"""
+    enc = _get_encoding(model)
+    if enc is None:
+        return len(text) // 4
+    return len(enc.encode(text))
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str) -> str:
+    """Cut text down to at most max_tokens tokens (or ~4 chars each without tiktoken)"""
+    enc = _get_encoding(model)
+    if enc is None:
+        return text[:max_tokens * 4]
+    tokens = enc.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return enc.decode(tokens[:max_tokens])
+
+def split_sections(content: str, file_type: str, max_tokens: int, model: str):
+    """Split content at section boundaries into chunks of at most max_tokens; oversized sections stay whole"""
+    chunks, current, current_tokens = [], [], 0
+    for section in _SECTION_SPLIT[file_type].split(content):
+        if not section:
+            continue
+        n = count_tokens(section, model)
+        if current and current_tokens + n > max_tokens:
+            chunks.append(''.join(current))
+            current, current_tokens = [], 0
+        current.append(section)
+        current_tokens += n
+    if current:
+        chunks.append(''.join(current))
+    return chunks
+
+# Agents whose pooled SMTP connection is closed at exit; weak, so an agent
+# built per file can still be freed as soon as its caller drops it
+_open_agents = weakref.WeakSet()
+
+@atexit.register
+def _close_open_agents():
+    for agent in list(_open_agents):
+        agent.close()
+
 # ----------------------------------------------------------------
 class PDFAgent:
     """Simplified AI Agent for file → IEEE format PDF conversion"""
 
-    def __init__(self, config_file="config.json"):
+    def __init__(self, config_file="config.json", use_cache=True, pandoc_slots=None):
         self.config = self.load_config(config_file)
-        if self.config.get('openai', {}).get('api_key'):
-            openai.api_key = self.config['openai']['api_key']
+        # Optional semaphore held only while pandoc runs, so callers can cap
+        # concurrent compiles without also queuing behind OpenAI waits
+        self._pandoc_slots = pandoc_slots or nullcontext()
+        # use_cache=False bypasses the refinement caches (memory and disk)
+        # and the conversion cache of finished PDFs
+        self.use_cache = use_cache
+        self._refine_cache = OrderedDict()
+        # Condense threads and batch workers share the LRU
+        self._refine_cache_lock = threading.Lock()
+        # Running token totals, to see how often the provider prompt cache hits
+        self._cache_hit_stats = {"calls": 0, "prompt": 0, "cached": 0, "completion": 0}
+        self._stats_lock = threading.Lock()
+        # Bounds in-flight OpenAI requests across batch workers and condense
+        # threads alike, to stay inside provider rate limits
+        self._openai_slots = threading.BoundedSemaphore(self.config['openai'].get('max_parallel', 4))
+        self.supported_formats = sorted(_MARKDOWN_EXT | _LATEX_EXT)
+        self._template_path = self._resolve_template()
+        # Checked once up front instead of retrying every failed conversion without it
+        if self._template_path and not _template_usable(self._template_path,
+                                                        os.path.getmtime(self._template_path)):
+            self._template_path = None
+        self._pandoc_args = self._resolve_pandoc_args()
+        # One authenticated SMTP connection, reused across send_email calls
+        self._smtp = None
+        # Re-entrant so send_email can run inside an smtp_session block
+        self._smtp_lock = threading.RLock()
+        _open_agents.add(self)
 
     # ----------------------------------------------------------------
     def load_config(self, config_file: str):
@@ -50,17 +371,25 @@ class PDFAgent:
                 "username": "",
                 "password": "",
                 "from_email": "",
-                "to_email": ""
+                "to_email": "",
+                "timeout": 30
             },
             "openai": {
                 "api_key": "",
                 "model": "gpt-4o-mini",
                 "temperature": 0.3,
-                "max_tokens": 4000
+                "max_tokens": 4000,
+                "max_parallel": 4,
+                "max_retries": 5,
+                "timeout": 60,
+                "escalate_model": "",
+                "escalate_threshold": 2000,
+                "context_window": 128000,
+                "max_input_bytes": 2097152
             },
             "pandoc": {
                 "engine": "xelatex",
-                "template": "ieee_template_proper.tex",
+                "template": DEFAULT_TEMPLATE,
                 "options": [
                     "--standalone",
                     "--toc",
@@ -69,137 +398,510 @@ class PDFAgent:
             },
             "output": {
                 "directory": "output"
+            },
+            "socketio": {
+                "flush_ms": 50,
+                "max_batch": 140
             }
         }
         if os.path.exists(config_file):
-            with open(config_file, 'r') as f:
-                cfg = json.load(f)
+            # Copy so per-agent changes never leak into the cached parse
+            cfg = copy.deepcopy(_read_config(config_file, os.path.getmtime(config_file)))
             for k, v in default_config.items():
                 if k not in cfg:
                     cfg[k] = v
             return cfg
         else:
-            with open(config_file, 'w') as f:
-                json.dump(default_config, f, indent=4)
+            with open(config_file, 'wb') as f:
+                f.write(_json_dumps(default_config))
             logger.warning("Created default config.json; please fill it in.")
             return default_config
 
     # ----------------------------------------------------------------
-    def send_email(self, attachment_path: str, subject="IEEE Document Conversion Complete"):
-        """Send PDF via email"""
+    def _smtp_conn(self):
+        """Return a live, authenticated SMTP connection; caller holds _smtp_lock"""
+        import smtplib
+
+        if self._smtp is not None:
+            try:
+                self._smtp.noop()
+            except (smtplib.SMTPException, OSError):
+                self._smtp = None
+        if self._smtp is None:
+            e = self.config['email']
+            # The connection is shared, so a stalled server must not block every send
+            server = smtplib.SMTP(e['smtp_server'], e['smtp_port'],
+                                  timeout=e.get('timeout', SMTP_TIMEOUT))
+            try:
+                server.starttls()
+                server.login(e['username'], e['password'])
+            except Exception:
+                server.close()
+                raise
+            self._smtp = server
+        return self._smtp
+
+    # ----------------------------------------------------------------
+    @contextmanager
+    def smtp_session(self):
+        """Hold the pooled SMTP connection for a batch of send_email(..., server=...) calls"""
+        with self._smtp_lock:
+            yield self._smtp_conn()
+
+    # ----------------------------------------------------------------
+    def close(self):
+        """Close the pooled SMTP connection, if one is open"""
+        with self._smtp_lock:
+            if self._smtp is not None:
+                import smtplib
+                try:
+                    self._smtp.quit()
+                except (smtplib.SMTPException, OSError):
+                    pass
+                self._smtp = None
+
+    # ----------------------------------------------------------------
+    def send_email(self, attachment_path: str, subject="IEEE Document Conversion Complete", server=None,
+                   to_email: str | None = None):
+        """Send PDF via email, to to_email if given, on server if inside smtp_session()"""
+        import smtplib
+        from email.message import EmailMessage
+
         try:
             e = self.config['email']
-            if not all([e['username'], e['password'], e['to_email']]):
+            recipient = to_email or e['to_email']
+            if not all([e['username'], e['password'], recipient]):
                 logger.warning("Incomplete email configuration.")
                 return False
 
-            msg = MIMEMultipart()
+            msg = EmailMessage()
             msg['From'] = e['from_email'] or e['username']
-            msg['To'] = e['to_email']
+            msg['To'] = recipient
             msg['Subject'] = subject
-            msg.attach(MIMEText("Please find attached your IEEE formatted document.", 'plain'))
+            msg.set_content("Please find attached your IEEE formatted document.")
 
             with open(attachment_path, 'rb') as f:
-                part = MIMEBase('application', 'octet-stream')
-                part.set_payload(f.read())
-                encoders.encode_base64(part)
-                part.add_header('Content-Disposition', f'attachment; filename={Path(attachment_path).name}')
-                msg.attach(part)
-
-            server = smtplib.SMTP(e['smtp_server'], e['smtp_port'])
-            server.starttls()
-            server.login(e['username'], e['password'])
-            server.sendmail(msg['From'], msg['To'], msg.as_string())
-            server.quit()
-            logger.info(f"Emailed {attachment_path} to {e['to_email']}")
+                msg.add_attachment(f.read(), maintype='application', subtype='pdf',
+                                   filename=Path(attachment_path).name)
+
+            # send_message serializes straight to bytes; no intermediate as_string() copy
+            with self._smtp_lock:
+                # An smtp_session batch skips the liveness probe; after a
+                # mid-batch reconnect self._smtp replaces the server it passed
+                if server is not None and self._smtp is not None:
+                    conn = self._smtp
+                else:
+                    conn = self._smtp_conn()
+                try:
+                    conn.send_message(msg)
+                except smtplib.SMTPServerDisconnected:
+                    # Dropped since it was last checked; reconnect and retry once
+                    self._smtp = None
+                    self._smtp_conn().send_message(msg)
+            logger.info("Emailed %s to %s", attachment_path, recipient)
             return True
         except Exception as ex:
-            logger.error(f"Email failed: {ex}")
+            logger.exception("Email failed: %s", ex)
             return False
 
     # ----------------------------------------------------------------
-    def convert_to_ieee_format(self, input_file: str, output_file: str | None = None) -> str:
-        """Convert file to IEEE format PDF using Pandoc"""
+    def _output_path(self, input_file: str) -> str:
+        """Default PDF path for an input file"""
+        out_dir = Path(self.config['output']['directory'])
+        out_dir.mkdir(parents=True, exist_ok=True)
+        return str(out_dir / f"{Path(input_file).stem}_IEEE.pdf")
+
+    # ----------------------------------------------------------------
+    @staticmethod
+    def _batch_output_paths(files, name_for) -> dict:
+        """Map each file to its own PDF path, numbering names that clash within the batch"""
+        paths, taken = {}, set()
+        for f in files:
+            if f in paths:
+                continue
+            path = name_for(f)
+            base, ext = os.path.splitext(path)
+            n = 1
+            while os.path.abspath(path) in taken:
+                n += 1
+                path = f"{base}_{n}{ext}"
+            if n > 1:
+                logger.warning("Output name of %s clashes with another input; using %s", f, path)
+            taken.add(os.path.abspath(path))
+            paths[f] = path
+        return paths
+
+    # ----------------------------------------------------------------
+    def _build_pandoc_cmd(self, input_file: str, output_file: str) -> list:
+        """Build the pandoc command line with IEEE specific options"""
+        return ["pandoc", str(input_file), "-o", str(output_file), *self._pandoc_args]
+
+    # ----------------------------------------------------------------
+    @staticmethod
+    def _stdin_args(file_type: str, resource_dir: str) -> tuple:
+        """Pandoc options for reading file_type from stdin, resolving resources from . then resource_dir"""
+        return ("-f", file_type, "--resource-path", os.pathsep.join((".", str(resource_dir))))
+
+    # ----------------------------------------------------------------
+    def _build_pandoc_stdin_cmd(self, stdin_args: tuple, output_file: str) -> list:
+        """Build a pandoc command that reads source from stdin; see _stdin_args"""
+        return ["pandoc", *stdin_args, "-o", str(output_file), *self._pandoc_args]
+
+    # ----------------------------------------------------------------
+    def _resolve_template(self) -> str | None:
+        """Absolute path of the configured (or bundled) pandoc template, looked up once per agent"""
+        template = self.config['pandoc'].get('template')
+        if template:
+            for candidate in (template, os.path.join(_MODULE_DIR, template)):
+                if os.path.isfile(candidate):
+                    return os.path.abspath(candidate)
+        default = os.path.join(_MODULE_DIR, DEFAULT_TEMPLATE)
+        if not os.path.isfile(default):
+            return None
+        if template:
+            logger.warning("Template %s not found; using %s", template, default)
+        return default
+
+    # ----------------------------------------------------------------
+    def _resolve_pandoc_args(self) -> tuple:
+        """Resolve the per-agent pandoc options; they don't change between files"""
+        args = []
+        
+        # Add engine
+        engine = self.config['pandoc'].get('engine', 'xelatex')
+        args.extend(["--pdf-engine", engine])
+        
+        # Add IEEE template if one was found
+        if self._template_path:
+            args.extend(["--template", self._template_path])
+        
+        # Add IEEE specific options for proper formatting
+        ieee_options = [
+            "--standalone",
+            "--number-sections",
+            "--columns", "72",
+            "-V", "geometry:margin=1in",
+            "-V", "fontsize=10pt",
+            "-V", "documentclass=IEEEtran",
+            "-V", "classoption=10pt,conference",
+            "--top-level-division=section"
+        ]
+        args.extend(ieee_options)
+        
+        # Add other options
+        options = self.config['pandoc'].get('options', [])
+        args.extend(options)
+        return tuple(args)
+
+
+    # ----------------------------------------------------------------
+    @staticmethod
+    def _resource_refs(source: bytes):
+        """Yield (name, fallback suffixes) for every file the source refers to"""
+        for pattern, suffixes, is_list in _RESOURCE_REFS:
+            for match in pattern.finditer(source):
+                names = _REF_LIST_SPLIT.split(match.group(1)) if is_list else [match.group(1)]
+                for name in names:
+                    name = os.fsdecode(name.strip(b' \t-[]"\''))
+                    if name and '://' not in name:
+                        yield name, suffixes
+
+    # ----------------------------------------------------------------
+    @classmethod
+    def _resource_fingerprints(cls, source: bytes, search_dirs, seen=None) -> list:
+        """(path, mtime, size) of every local file the source pulls in, recursing into \\input files"""
+        seen = set() if seen is None else seen
+        prints = []
+        for ref, suffixes in cls._resource_refs(source):
+            found = None
+            for base in search_dirs:
+                candidate = os.path.join(base, ref)
+                for path in [candidate] + [candidate + ext for ext in suffixes]:
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    if os.path.isfile(path):
+                        found = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+                        break
+                if found:
+                    break
+            # A missing file is keyed too, so creating it later changes the key
+            prints.append(found or (ref, None, None))
+            if found and found[0] not in seen and os.path.splitext(found[0])[1].lower() in _LATEX_EXT:
+                seen.add(found[0])
+                with open(found[0], 'rb') as f:
+                    prints.extend(cls._resource_fingerprints(f.read(), search_dirs, seen))
+        return prints
+
+    # ----------------------------------------------------------------
+    def _source_digest(self, input_file: str, source_bytes: bytes | None = None,
+                       file_type: str | None = None) -> bytes:
+        """Digest of the source bytes, their format and the files they pull in"""
+        if source_bytes is None:
+            with open(input_file, 'rb') as f:
+                source_bytes = f.read()
+        h = hashlib.blake2b(source_bytes, digest_size=20)
+        h.update((file_type or file_type_for(input_file)).encode('utf-8'))
+        resource_dirs = ('.', str(Path(input_file).parent))
+        for path, mtime_ns, size in self._resource_fingerprints(source_bytes, resource_dirs):
+            h.update(f"\0{path}\0{mtime_ns}\0{size}".encode('utf-8'))
+        return h.digest()
+
+    # ----------------------------------------------------------------
+    def _conversion_cache_path(self, input_file: str, source_bytes: bytes | None = None,
+                               stdin_args: tuple = (), source_digest: bytes | None = None) -> Path:
+        """Cache location for the PDF of this input under the current pandoc options and template"""
+        if source_digest is None:
+            file_type = stdin_args[stdin_args.index("-f") + 1] if stdin_args else None
+            source_digest = self._source_digest(input_file, source_bytes, file_type)
+        h = hashlib.blake2b(source_digest, digest_size=20)
+        h.update(repr((self._pandoc_args, stdin_args)).encode('utf-8'))
+        if self._template_path:
+            h.update(_file_digest(self._template_path, os.path.getmtime(self._template_path)))
+        return Path(self.config['output']['directory']) / "cache" / f"{h.hexdigest()}.pdf"
+
+    # ----------------------------------------------------------------
+    def _restore_cached_pdf(self, cache_path: Path, output_file: str) -> bool:
+        """Copy a cached PDF to output_file; returns False on a cache miss"""
+        if not self.use_cache:
+            return False
+        # Copies rather than hardlinks: pandoc rewrites its output file in
+        # place, which would corrupt a cache entry sharing the inode
+        try:
+            shutil.copyfile(cache_path, output_file)
+        except FileNotFoundError:
+            return False
+        try:
+            # Refresh its mtime so _evict_disk_cache treats it as recently used
+            os.utime(cache_path)
+        except OSError:
+            pass
+        logger.info("Reused cached PDF for unchanged input: %s", output_file)
+        return True
+
+    # ----------------------------------------------------------------
+    def _store_cached_pdf(self, output_file: str, cache_path: Path):
+        """Atomically add a freshly built PDF to the conversion cache"""
+        if not self.use_cache:
+            return
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            _write_atomically(cache_path, lambda tmp_path: shutil.copyfile(output_file, tmp_path))
+            self._evict_disk_cache(cache_path.parent, '.pdf', CONVERSION_CACHE_SIZE)
+        except OSError as e:
+            logger.warning("Could not cache PDF %s: %s", output_file, e)
+
+    # ----------------------------------------------------------------
+    def convert_to_ieee_format(self, input_file: str, output_file: str | None = None,
+                               source_text: str | None = None, file_type: str | None = None) -> str:
+        """Convert file (or source_text piped as file_type) to IEEE format PDF using Pandoc"""
         try:
-            input_path = Path(input_file)
             if not output_file:
-                out_dir = Path(self.config['output']['directory'])
-                out_dir.mkdir(parents=True, exist_ok=True)
-                output_file = str(out_dir / f"{input_path.stem}_IEEE.pdf")
-            
-            # Build pandoc command with IEEE specific options
-            cmd = ["pandoc", str(input_path), "-o", str(output_file)]
+                output_file = self._output_path(input_file)
             
-            # Add engine
-            engine = self.config['pandoc'].get('engine', 'xelatex')
-            cmd.extend(["--pdf-engine", engine])
+            source_bytes = None
+            stdin_args = ()
+            if source_text is not None:
+                source_bytes = source_text.encode('utf-8')
+                stdin_args = self._stdin_args(file_type, Path(input_file).parent)
+            cache_path = self._conversion_cache_path(input_file, source_bytes, stdin_args)
+            if self._restore_cached_pdf(cache_path, output_file):
+                return str(output_file)
             
-            # Add IEEE template if specified
-            template = self.config['pandoc'].get('template')
-            if template:
-                # Check if template exists in current directory
-                template_path = Path(template)
-                if template_path.exists():
-                    cmd.extend(["--template", str(template_path)])
-                else:
-                    # Check if it's in the current directory
-                    local_template = Path.cwd() / template
-                    if local_template.exists():
-                        cmd.extend(["--template", str(local_template)])
+            if source_text is None:
+                cmd = self._build_pandoc_cmd(input_file, output_file)
             else:
-                # Use default IEEE template if available
-                default_template = Path("ieee_template_proper.tex")
-                if default_template.exists():
-                    cmd.extend(["--template", str(default_template)])
-            
-            # Add IEEE specific options for proper formatting
-            ieee_options = [
-                "--standalone",
-                "--number-sections",
-                "--columns", "72",
-                "-V", "geometry:margin=1in",
-                "-V", "fontsize=10pt",
-                "-V", "documentclass=IEEEtran",
-                "-V", "classoption=10pt,conference",
-                "--top-level-division=section"
-            ]
-            cmd.extend(ieee_options)
+                cmd = self._build_pandoc_stdin_cmd(stdin_args, output_file)
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Running pandoc command: %s", ' '.join(cmd))
+            with self._pandoc_slots:
+                returncode, stderr = self._run_pandoc(cmd, source_text)
             
-            # Add other options
-            options = self.config['pandoc'].get('options', [])
-            cmd.extend(options)
+            if returncode != 0:
+                logger.error("Pandoc conversion failed: %s", stderr)
+                return ""
+            logger.info("Successfully converted %s to IEEE format PDF: %s", input_file, output_file)
             
-            logger.info(f"Running pandoc command: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                logger.info(f"Successfully converted {input_file} to IEEE format PDF: {output_file}")
-                return str(output_file)
-            else:
-                logger.error(f"Pandoc conversion failed: {result.stderr}")
-                # Try without template as fallback
-                logger.info("Trying conversion without template as fallback...")
-                cmd_without_template = [arg for arg in cmd if not arg.startswith("--template")]
-                result_fallback = subprocess.run(cmd_without_template, capture_output=True, text=True)
-                if result_fallback.returncode == 0:
-                    logger.info(f"Successfully converted {input_file} to PDF (without template): {output_file}")
-                    return str(output_file)
-                else:
-                    logger.error(f"Fallback conversion also failed: {result_fallback.stderr}")
-                    return ""
+            self._store_cached_pdf(output_file, cache_path)
+            return str(output_file)
                 
         except Exception as e:
-            logger.error(f"Pandoc conversion error: {e}")
+            logger.exception("Pandoc conversion error: %s", e)
             return ""
 
+    # ----------------------------------------------------------------
+    def _run_pandoc(self, cmd: list, source_text: str | None = None):
+        """Run pandoc, streaming its stderr to the debug log; returns (returncode, stderr tail)"""
+        proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE if source_text is not None else subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            text=True, encoding='utf-8', errors='replace', bufsize=1
+        )
+        if source_text is not None:
+            # Fed from a thread so a chatty stderr can't deadlock against a full stdin pipe
+            threading.Thread(target=self._feed_stdin, args=(proc.stdin, source_text), daemon=True).start()
+        tail = deque(maxlen=PANDOC_STDERR_TAIL)
+        for line in proc.stderr:
+            line = line.rstrip()
+            logger.debug("pandoc: %s", line)
+            tail.append(line)
+        proc.stderr.close()
+        return proc.wait(), "\n".join(tail)
+
+    # ----------------------------------------------------------------
+    @staticmethod
+    def _feed_stdin(stdin, text: str):
+        """Write text to a child's stdin and close it; a child that exits early is fine"""
+        try:
+            stdin.write(text)
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                stdin.close()
+            except BrokenPipeError:
+                pass
+
+    # ----------------------------------------------------------------
+    async def _run_pandoc_async(self, cmd: list):
+        """Run pandoc without blocking the event loop; returns (returncode, stderr tail)"""
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+        )
+        tail = deque(maxlen=PANDOC_STDERR_TAIL)
+        async for raw in proc.stderr:
+            line = raw.decode('utf-8', errors='replace').rstrip()
+            logger.debug("pandoc: %s", line)
+            tail.append(line)
+        return await proc.wait(), "\n".join(tail)
+
+    # ----------------------------------------------------------------
+    async def convert_to_ieee_format_async(self, input_file: str, sem: asyncio.Semaphore,
+                                           output_file: str | None = None,
+                                           source_digest: bytes | None = None) -> str:
+        """Async counterpart of convert_to_ieee_format, gated by a semaphore"""
+        try:
+            output_file = output_file or self._output_path(input_file)
+            cache_path = self._conversion_cache_path(input_file, source_digest=source_digest)
+            if self._restore_cached_pdf(cache_path, output_file):
+                return output_file
+            cmd = self._build_pandoc_cmd(input_file, output_file)
+            async with sem:
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("Running pandoc command: %s", ' '.join(cmd))
+                returncode, stderr = await self._run_pandoc_async(cmd)
+                if returncode != 0:
+                    logger.error("Pandoc conversion failed for %s: %s", input_file, stderr)
+                    return ""
+            logger.info("Successfully converted %s to IEEE format PDF: %s", input_file, output_file)
+            self._store_cached_pdf(output_file, cache_path)
+            return output_file
+        except Exception as e:
+            logger.exception("Pandoc conversion error: %s", e)
+            return ""
+
+    # ----------------------------------------------------------------
+    async def _convert_and_send_async(self, input_file: str, sem: asyncio.Semaphore, send_email: bool,
+                                      output_file: str | None = None,
+                                      source_digest: bytes | None = None) -> str:
+        """Convert one file, then email it while other conversions keep running"""
+        pdf_path = await self.convert_to_ieee_format_async(input_file, sem, output_file, source_digest)
+        if pdf_path and send_email:
+            # The SMTP session is shared and locked, so sends queue up behind
+            # each other but no longer wait for the whole batch to convert
+            await asyncio.to_thread(self.send_email, pdf_path, "Your IEEE Formatted PDF is Ready")
+        return pdf_path
+
+    # ----------------------------------------------------------------
+    def list_supported_files(self, directory: str) -> list:
+        """Supported input files directly inside directory"""
+        # One directory listing, classified by extension, instead of a glob per format
+        exts = frozenset(self.supported_formats)
+        with os.scandir(directory) as it:
+            return [entry.path for entry in it
+                    if entry.is_file() and os.path.splitext(entry.name)[1].lower() in exts]
+
+    # ----------------------------------------------------------------
+    async def process_files_async(self, inputs, send_email=True, workers=None):
+        """Convert a batch of files with at most `workers` pandoc runs in flight; maps input to PDF path"""
+        files = self._existing_files(inputs)
+        groups = self._group_duplicates(files)
+        out_paths = self._batch_output_paths(files, self._output_path)
+        sem = asyncio.Semaphore(workers or os.cpu_count() or 1)
+        pdf_paths = await asyncio.gather(
+            *(self._convert_and_send_async(group[0], sem, send_email, out_paths[group[0]], digest)
+              for digest, group in groups.items())
+        )
+        results = dict.fromkeys(inputs, "")
+        for group, pdf_path in zip(groups.values(), pdf_paths):
+            self._fill_duplicates(results, group, pdf_path, out_paths.__getitem__)
+        return results
+
+    # ----------------------------------------------------------------
+    @staticmethod
+    def _existing_files(inputs) -> list:
+        """Inputs that are files, logging each one that is not"""
+        files = []
+        for f in inputs:
+            if os.path.isfile(f):
+                files.append(f)
+            else:
+                logger.error("Input file not found: %s", f)
+        return files
+
+    # ----------------------------------------------------------------
+    def _group_duplicates(self, files) -> dict:
+        """Group files by _source_digest so identical inputs are processed once; first path leads"""
+        groups = {}
+        for f in files:
+            groups.setdefault(self._source_digest(f), []).append(f)
+        for group in groups.values():
+            if len(group) > 1:
+                logger.info("Skipping %d duplicate(s) of %s", len(group) - 1, group[0])
+        return groups
+
+    # ----------------------------------------------------------------
+    @staticmethod
+    def _fill_duplicates(results: dict, group, pdf_path: str, output_path_for):
+        """Record the leader's PDF and give each duplicate its own copy of it"""
+        results[group[0]] = pdf_path
+        for dup in group[1:]:
+            if not pdf_path:
+                continue
+            dup_pdf = output_path_for(dup)
+            try:
+                if os.path.abspath(dup_pdf) != os.path.abspath(pdf_path):
+                    shutil.copyfile(pdf_path, dup_pdf)
+                results[dup] = dup_pdf
+            except OSError as e:
+                logger.error("Could not copy PDF for duplicate %s: %s", dup, e)
+
+    # ----------------------------------------------------------------
+    def process_files(self, inputs, send_email=True, workers=None):
+        """Synchronous wrapper around process_files_async"""
+        return asyncio.run(self.process_files_async(inputs, send_email, workers))
+
     # ----------------------------------------------------------------
     def process_file(self, input_file: str, send_email=True, email_recipient=None):
         """Process file: convert to IEEE format PDF and optionally send via email"""
+        if not os.path.isfile(input_file):
+            logger.error("Input file not found: %s", input_file)
+            return False
+        logger.info("Processing file for IEEE format: %s", input_file)
+        return self._process_file_impl(input_file, send_email, email_recipient)
+
+    # ----------------------------------------------------------------
+    def _process_file_impl(self, input_file: str, send_email=True, email_recipient=None,
+                           output_file: str | None = None, source_text: str | None = None,
+                           file_type: str | None = None):
+        """Convert and email an input the caller has already validated"""
         try:
-            logger.info(f"Processing file for IEEE format: {input_file}")
-            
             # Convert file to IEEE format PDF using Pandoc
-            pdf_path = self.convert_to_ieee_format(input_file)
+            pdf_path = self.convert_to_ieee_format(input_file, output_file,
+                                                   source_text=source_text, file_type=file_type)
             
             if not pdf_path:
                 logger.error("Failed to convert file to IEEE format PDF.")
@@ -208,112 +910,287 @@ class PDFAgent:
             # Send email if requested
             if send_email:
                 # Use provided recipient or fall back to config
-                if email_recipient:
-                    original_recipient = self.config['email']['to_email']
-                    self.config['email']['to_email'] = email_recipient
-                    self.send_email(pdf_path, subject="Your IEEE Formatted PDF is Ready")
-                    # Restore original recipient
-                    self.config['email']['to_email'] = original_recipient
-                else:
-                    self.send_email(pdf_path, subject="Your IEEE Formatted PDF is Ready")
+                self.send_email(pdf_path, subject="Your IEEE Formatted PDF is Ready", to_email=email_recipient)
             
             logger.info("IEEE format file processing completed successfully.")
-            return True
+            return pdf_path
             
         except Exception as e:
-            logger.error(f"File processing error: {e}")
+            logger.exception("File processing error: %s", e)
             return False
 
     # ----------------------------------------------------------------
-    def refine_to_ieee_style(self, content: str, file_type: str):
-        """Use OpenAI to convert content to IEEE-style sections"""
-        try:
-            if not self.config['openai']['api_key']:
-                return {"error": "OpenAI API key not set"}
-
-            prompt = f"""
-            You are an expert IEEE research paper writer and editor. Convert the following {file_type} text into a formally structured IEEE-style research paper with the exact section layout and formatting rules described below.
-
-            Required Paper Structure:
-
-            Abstract:
-
-            Write a single, cohesive paragraph summarizing the entire paper.
-
-            Do not include the word "Abstract" at the beginning.
-
-            Keywords:
-
-            Provide 3–8 technical keywords separated by commas.
+    def _refine_cache_key(self, content: str, file_type: str, task: str = "ieee", model: str | None = None):
+        """Build the cache key for a refinement (or condense) request"""
+        o = self.config['openai']
+        digest = hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+        return f"{task}|{digest}|{file_type}|{model or o['model']}|{o['temperature']}|{IEEE_PROMPT_VERSION}"
 
-            Do not include the word "Keywords" at the beginning.
+    # ----------------------------------------------------------------
+    def _route_model(self, n_tokens: int) -> str:
+        """Pick the model for a refinement of n_tokens, escalating long documents when configured"""
+        o = self.config['openai']
+        escalate_model = o.get('escalate_model')
+        if escalate_model and n_tokens >= o.get('escalate_threshold', 2000):
+            return escalate_model
+        return o['model']
 
-            I. INTRODUCTION
+    # ----------------------------------------------------------------
+    def _refine_cache_file(self, key: str) -> Path:
+        """On-disk location of a cached refinement, so results survive restarts"""
+        name = hashlib.blake2b(key.encode('utf-8'), digest_size=20).hexdigest()
+        return Path(self.config['output']['directory']) / "cache" / "refine" / f"{name}.txt"
 
-            Write a detailed paragraph introducing the topic, background, motivation, and objectives.
+    # ----------------------------------------------------------------
+    def _cache_get(self, key: str):
+        """Return a cached response and mark it recently used, or None"""
+        if not self.use_cache:
+            return None
+        with self._refine_cache_lock:
+            value = self._refine_cache.get(key)
+            if value is not None:
+                self._refine_cache.move_to_end(key)
+                return value
+        path = self._refine_cache_file(key)
+        try:
+            value = path.read_text(encoding='utf-8')
+        except FileNotFoundError:
+            return None
+        try:
+            # mtime doubles as last-use time for disk eviction
+            os.utime(path)
+        except OSError:
+            pass
+        self._remember(key, value)
+        return value
 
-            Ensure clarity and academic tone.
+    # ----------------------------------------------------------------
+    def _remember(self, key: str, value: str):
+        """Keep a response in memory, evicting the least recently used entry when full"""
+        with self._refine_cache_lock:
+            self._refine_cache[key] = value
+            self._refine_cache.move_to_end(key)
+            if len(self._refine_cache) > REFINE_CACHE_SIZE:
+                self._refine_cache.popitem(last=False)
 
-            II. METHODOLOGY
+    # ----------------------------------------------------------------
+    def _cache_put(self, key: str, value: str):
+        """Store a response in memory and on disk"""
+        if not self.use_cache:
+            return
+        self._remember(key, value)
+        path = self._refine_cache_file(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            _write_atomically(path, lambda tmp_path: Path(tmp_path).write_text(value, encoding='utf-8'))
+            self._evict_disk_cache(path.parent, '.txt', REFINE_DISK_CACHE_SIZE)
+        except OSError as e:
+            logger.warning("Could not cache refinement on disk: %s", e)
 
-            Write a detailed paragraph explaining the methods, techniques, datasets, or approaches used in the research.
+    # ----------------------------------------------------------------
+    @staticmethod
+    def _evict_disk_cache(cache_dir: Path, suffix: str, max_entries: int):
+        """Drop the least recently used `suffix` files in cache_dir beyond max_entries"""
+        with os.scandir(cache_dir) as it:
+            entries = [(entry.stat().st_mtime, entry.path) for entry in it
+                       if entry.name.endswith(suffix)]
+        if len(entries) <= max_entries:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - max_entries]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
 
-            III. RESULTS AND DISCUSSION
+    # ----------------------------------------------------------------
+    def _complete(self, prompt: str, on_delta=None, system: str | None = None,
+                  prompt_cache_key: str | None = None, model: str | None = None) -> tuple:
+        """Send a single-prompt chat completion, streamed to on_delta if given; returns (reply text, finished)"""
+        o = self.config['openai']
+        client = get_openai_client(o['api_key'], o.get('max_retries', 5), o.get('timeout', OPENAI_TIMEOUT))
+        messages = [{"role": "user", "content": prompt}]
+        if system:
+            messages.insert(0, {"role": "system", "content": system})
+        # Sent via extra_body so older SDKs without these keywords still work
+        extra_body = {}
+        if prompt_cache_key:
+            extra_body["prompt_cache_key"] = prompt_cache_key
+        stream = on_delta is not None
+        if stream:
+            # Streams only report usage in a final, choice-less chunk on request
+            extra_body["stream_options"] = {"include_usage": True}
+        with self._openai_slots:
+            resp = client.chat.completions.create(
+                model=model or o['model'],
+                messages=messages,
+                max_tokens=o['max_tokens'],
+                temperature=o['temperature'],
+                stream=stream,
+                extra_body=extra_body or None
+            )
+            if not stream:
+                self._record_usage(getattr(resp, 'usage', None))
+                choice = resp.choices[0]
+                return choice.message.content, choice.finish_reason == "stop"
 
-            Present key findings, insights, or performance results.
+            parts = []
+            finish_reason = None
+            for chunk in resp:
+                if getattr(chunk, 'usage', None):
+                    self._record_usage(chunk.usage)
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+                if choice.delta.content:
+                    parts.append(choice.delta.content)
+                    on_delta(choice.delta.content)
+            return ''.join(parts), finish_reason == "stop"
 
-            Include analytical discussion of implications, strengths, and limitations.
+    # ----------------------------------------------------------------
+    def _record_usage(self, usage):
+        """Log token usage for one completion and add it to the running totals"""
+        if usage is None:
+            return
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached = getattr(details, 'cached_tokens', 0) or 0
+        logger.info("OpenAI tokens: prompt=%d cached=%d completion=%d",
+                    usage.prompt_tokens, cached, usage.completion_tokens)
+        with self._stats_lock:
+            stats = self._cache_hit_stats
+            stats["calls"] += 1
+            stats["prompt"] += usage.prompt_tokens
+            stats["cached"] += cached
+            stats["completion"] += usage.completion_tokens
 
-            IV. CONCLUSION
+    # ----------------------------------------------------------------
+    def log_usage_summary(self):
+        """Log total token usage and the prompt cache hit ratio for this run"""
+        with self._stats_lock:
+            stats = dict(self._cache_hit_stats)
+        if not stats["calls"]:
+            return
+        ratio = stats["cached"] / stats["prompt"] if stats["prompt"] else 0.0
+        logger.info("OpenAI usage: %d calls, prompt=%d (%.0f%% cached), completion=%d",
+                    stats["calls"], stats["prompt"], ratio * 100, stats["completion"])
 
-            Summarize the major contributions and findings.
+    # ----------------------------------------------------------------
+    def _condense_chunk(self, chunk: str, file_type: str) -> str:
+        """Condense one slice of a long document ahead of IEEE refinement, cached per chunk"""
+        cache_key = self._refine_cache_key(chunk, file_type, task="condense")
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
 
-            Include remarks on possible future work or open challenges.
+        prompt = CONDENSE_PROMPT_TEMPLATE.format_map({"file_type": file_type, "content": chunk})
+        condensed, finished = self._complete(prompt)
+        if condensed and finished:
+            self._cache_put(cache_key, condensed)
+        return condensed
 
-            Formatting Rules:
+    # ----------------------------------------------------------------
+    def _condense_sections(self, content: str, file_type: str) -> str:
+        """Map step for oversized documents: condense sections concurrently"""
+        model = self.config['openai']['model']
+        chunks = split_sections(content, file_type, CHUNK_TOKEN_THRESHOLD, model)
+        if len(chunks) < 2:
+            return content
+        logger.info("Condensing %d sections before IEEE refinement", len(chunks))
+        # _complete's shared slots bound the requests actually in flight
+        max_parallel = self.config['openai'].get('max_parallel', 4)
+        with ThreadPoolExecutor(max_workers=min(max_parallel, len(chunks))) as pool:
+            condensed = list(pool.map(lambda c: self._condense_chunk(c, file_type), chunks))
+        return "\n\n".join(part for part in condensed if part)
 
-            Do NOT include section headers like "Abstract:" or "Keywords:" in the text — only the content.
+    # ----------------------------------------------------------------
+    def _fit_context(self, content: str, file_type: str, model: str) -> str:
+        """Trim content so prompt plus completion fit the model's context window"""
+        o = self.config['openai']
+        allowed = o.get('context_window', 128000) - o['max_tokens'] - CONTEXT_RESERVE_TOKENS
+        before = count_tokens(content, model)
+        if before <= allowed:
+            return content
 
-            Do NOT include section numbers (I., II., etc.) inside the content paragraphs.
+        trimmed = content
+        match = _REFERENCES_START[file_type].search(trimmed)
+        if match:
+            trimmed = trimmed[:match.start()]
+        if count_tokens(trimmed, model) > allowed:
+            trimmed = truncate_to_tokens(trimmed, allowed, model) + "\n\n[...truncated...]"
+        logger.warning("Trimmed document from %d to %d tokens to fit the context window",
+                       before, count_tokens(trimmed, model))
+        return trimmed
 
-            Each section must be written as a formal, detailed academic paragraph (not bullet points).
+    # ----------------------------------------------------------------
+    def refine_to_ieee_style(self, content: str, file_type: str, on_delta=None):
+        """Use OpenAI to convert content to IEEE-style sections"""
+        try:
+            if not self.config['openai']['api_key']:
+                return {"error": "OpenAI API key not set"}
 
-            Use technical, IEEE-style English — precise, impersonal, and objective.
+            n_tokens = count_tokens(content, self.config['openai']['model'])
+            model = self._route_model(n_tokens)
+            cache_key = self._refine_cache_key(content, file_type, model=model)
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                logger.info("Using cached IEEE refinement")
+                return {"content": cached}
 
-            Preserve the technical meaning and flow of the original {file_type} text but improve clarity and grammar.
+            # Reduce step: oversized documents are condensed first so the
+            # whole paper still fits in one refinement prompt
+            if n_tokens > CHUNK_TOKEN_THRESHOLD:
+                content = self._condense_sections(content, file_type)
+            content = self._fit_context(content, file_type, model)
 
-            Content:
-            {content}
-            
-            IMPORTANT: Your response should ONLY contain the properly formatted IEEE paper content. Do not include any explanations or additional text.
-            """
+            prompt = IEEE_USER_PROMPT_TEMPLATE.format_map({"file_type": file_type, "content": content})
             
-            client = openai.OpenAI(api_key=self.config['openai']['api_key'])
-            resp = client.chat.completions.create(
-                model=self.config['openai']['model'],
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=self.config['openai']['max_tokens'],
-                temperature=self.config['openai']['temperature']
-            )
-            refined = resp.choices[0].message.content
+            logger.info("Refining %d-token document with %s", n_tokens, model)
+            refined, finished = self._complete(prompt, on_delta, system=IEEE_SYSTEM_PROMPT,
+                                               prompt_cache_key=f"ieee_v{IEEE_PROMPT_VERSION}",
+                                               model=model)
+            if refined and finished:
+                self._cache_put(cache_key, refined)
+            elif refined:
+                logger.warning("Refinement was cut off before finishing; not caching it")
             return {"content": refined}
         except Exception as e:
-            logger.error(f"OpenAI refinement failed: {e}")
+            logger.exception("OpenAI refinement failed: %s", e)
             return {"error": str(e)}
 
     # ----------------------------------------------------------------
-    def process_with_ieee_refinement(self, input_file: str, send_email=True, email_recipient=None):
+    @staticmethod
+    def _read_text(path: str) -> str:
+        """Read a whole input document as UTF-8 text through a 1 MiB buffer"""
+        with open(path, 'r', encoding='utf-8', buffering=1 << 20) as f:
+            return f.read()
+
+    # ----------------------------------------------------------------
+    def _refined_output_path(self, input_file: str) -> str:
+        """Default PDF path for the AI-refined version of an input file"""
+        return self._output_path(f"ieee_{Path(input_file).name}")
+
+    # ----------------------------------------------------------------
+    def process_with_ieee_refinement(self, input_file: str, send_email=True, email_recipient=None, on_delta=None,
+                                     output_file: str | None = None):
         """Process file with IEEE academic writing refinement"""
         try:
-            # Read the input file
-            with open(input_file, 'r', encoding='utf-8') as f:
-                content = f.read()
+            # Fail fast on inputs far beyond what one refinement can use
+            limit = self.config['openai'].get('max_input_bytes', 2 * 1024 * 1024)
+            size = os.path.getsize(input_file)
+            if size > limit:
+                logger.error("Input too large for AI refinement (%d bytes > %d): %s", size, limit, input_file)
+                return False
+            
+            # Read the input file once; everything below works on this string
+            content = self._read_text(input_file)
             
             # Detect file type
-            file_type = 'latex' if input_file.endswith(('.tex', '.latex')) else 'markdown'
+            file_type = file_type_for(input_file)
             
             # Refine the content to IEEE style
-            refinement = self.refine_to_ieee_style(content, file_type)
+            refinement = self.refine_to_ieee_style(content, file_type, on_delta)
             if 'error' in refinement:
                 logger.error(refinement['error'])
                 return False
@@ -323,33 +1200,57 @@ class PDFAgent:
                 logger.error("No content returned from refinement.")
                 return False
             
-            # Save refined content to a temporary file
-            temp_dir = Path(self.config['output']['directory'])
-            temp_dir.mkdir(parents=True, exist_ok=True)
-            temp_file = temp_dir / f"ieee_{Path(input_file).name}"
-            
-            with open(temp_file, 'w', encoding='utf-8') as f:
-                f.write(refinement['content'])
-            
-            # Process the refined file
-            result = self.process_file(str(temp_file), send_email, email_recipient)
+            # Pipe the refined text straight to pandoc; no intermediate file
+            output_file = output_file or self._refined_output_path(input_file)
+            result = self._process_file_impl(input_file, send_email, email_recipient,
+                                             output_file=output_file,
+                                             source_text=refinement['content'],
+                                             file_type=file_type)
             return result
         except Exception as e:
-            logger.error(f"File processing with IEEE refinement error: {e}")
+            logger.exception("File processing with IEEE refinement error: %s", e)
             return False
 
     # ----------------------------------------------------------------
-    def process_file_with_fallback(self, input_file: str, send_email=True, email_recipient=None, use_ai_refinement=False):
+    def process_files_with_refinement(self, inputs, send_email=True, workers=None):
+        """Refine and convert a batch of files on worker threads, then email the PDFs"""
+        workers = workers or self.config['openai'].get('max_parallel', 4)
+        results = dict.fromkeys(inputs, "")
+        files = self._existing_files(inputs)
+        groups = self._group_duplicates(files)
+        out_paths = self._batch_output_paths(files, self._refined_output_path)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(groups) or 1))) as pool:
+            futures = {pool.submit(self.process_with_ieee_refinement, group[0], False,
+                                   output_file=out_paths[group[0]]): group
+                       for group in groups.values()}
+            for fut in as_completed(futures):
+                self._fill_duplicates(results, futures[fut], fut.result() or "", out_paths.__getitem__)
+
+        # Duplicates share content, so only each group's leader is emailed
+        pdfs = [results[group[0]] for group in groups.values() if results[group[0]]]
+        if send_email and pdfs:
+            # One held SMTP session for the whole batch
+            try:
+                with self.smtp_session() as server:
+                    for pdf_path in pdfs:
+                        self.send_email(pdf_path, "Your IEEE Formatted PDF is Ready", server=server)
+            except Exception as e:
+                logger.exception("Batch email failed: %s", e)
+        return results
+
+    # ----------------------------------------------------------------
+    def process_file_with_fallback(self, input_file: str, send_email=True, email_recipient=None, use_ai_refinement=False, on_delta=None):
         """Process file with fallback from AI refinement to pandoc if AI fails"""
         try:
-            logger.info(f"Processing file: {input_file}")
+            logger.info("Processing file: %s", input_file)
             
             if use_ai_refinement:
                 logger.info("Attempting AI-based IEEE formatting...")
-                success = self.process_with_ieee_refinement(input_file, send_email, email_recipient)
-                if success:
+                pdf_path = self.process_with_ieee_refinement(input_file, send_email, email_recipient, on_delta)
+                if pdf_path:
                     logger.info("AI-based formatting successful!")
-                    return True
+                    return pdf_path
                 else:
                     logger.warning("AI-based formatting failed, falling back to pandoc...")
             
@@ -358,25 +1259,46 @@ class PDFAgent:
             return self.process_file(input_file, send_email, email_recipient)
             
         except Exception as e:
-            logger.error(f"File processing with fallback error: {e}")
+            logger.exception("File processing with fallback error: %s", e)
             return False
 
 # ----------------------------------------------------------------
 def main():
     parser = argparse.ArgumentParser(description="Convert documents to IEEE format PDF")
-    parser.add_argument("input", help="Path to input file (.md, .tex, etc.)")
+    parser.add_argument("input", nargs="+", help="Input file(s) (.md, .tex, etc.) or directory")
     parser.add_argument("--config", default="config.json", help="Path to config.json")
     parser.add_argument("--refine", action="store_true", help="Refine to IEEE academic writing")
     parser.add_argument("--no-email", action="store_true", help="Skip email sending")
+    parser.add_argument("--directory", action="store_true", help="Process every supported file in the input directory")
+    parser.add_argument("--workers", type=int, default=None, help="Files converted at once for --directory or several inputs, with or without --refine (default: CPU count, or openai.max_parallel with --refine)")
+    parser.add_argument("--no-cache", action="store_true", help="Always call OpenAI and pandoc instead of reusing cached refinements and PDFs")
     args = parser.parse_args()
 
-    agent = PDFAgent(args.config)
+    agent = PDFAgent(args.config, use_cache=not args.no_cache)
+    
+    inputs, listed = args.input, True
+    if args.directory:
+        # One batch across all directories, so clashing names get distinct PDFs
+        inputs = []
+        for directory in args.input:
+            try:
+                inputs.extend(agent.list_supported_files(directory))
+            except OSError as e:
+                logger.error("Cannot read directory %s: %s", directory, e)
+                listed = False
+        if not inputs:
+            logger.warning("No supported files found in %s", ", ".join(args.input))
     
-    if args.refine:
-        success = agent.process_with_ieee_refinement(args.input)
+    if args.directory or len(args.input) > 1:
+        batch = agent.process_files_with_refinement if args.refine else agent.process_files
+        results = batch(inputs, send_email=not args.no_email, workers=args.workers)
+        success = listed and bool(results) and all(results.values())
+    elif args.refine:
+        success = agent.process_with_ieee_refinement(args.input[0], send_email=not args.no_email)
     else:
-        success = agent.process_file(args.input, send_email=not args.no_email)
+        success = agent.process_file(args.input[0], send_email=not args.no_email)
     
+    agent.log_usage_summary()
     sys.exit(0 if success else 1)
 
 # ----------------------------------------------------------------